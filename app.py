@@ -1,11 +1,14 @@
 import os
-import json
+import asyncio
 import numpy as np
 import faiss
+import pyarrow.feather as feather
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List
+from collections import OrderedDict
+from itertools import count
 from google import genai  # ✅ Correct import for google-genai package
 from google.genai import types  # Import types for configuration
 from dotenv import load_dotenv
@@ -20,10 +23,14 @@ load_dotenv()
 
 # Constants
 FAISS_INDEX_PATH = "model/virtual-ta.faiss"
-METADATA_PATH = "model/metadata.json"
+METADATA_PATH = "model/metadata.arrow"
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 SIMILARITY_THRESHOLD = 0
 TOP_K_RESULTS = 5
+HNSW_EF_SEARCH = 64
+EMBEDDING_CACHE_SIZE = 2048
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_THRESHOLD = 0.95  # cosine similarity for reusing a cached answer
 
 # Initialize Gemini client
 if not GEMINI_API_KEY:
@@ -32,20 +39,58 @@ if not GEMINI_API_KEY:
 
 client = genai.Client(api_key=GEMINI_API_KEY)
 
+
+def faiss_simd_level() -> str:
+    """SIMD level FAISS is actually running with"""
+    simd_config = getattr(faiss, "SIMDConfig", None)
+    # has_dynamic_dispatch() is missing from some releases (e.g. 1.14), which
+    # only ship dynamic-dispatch builds
+    has_dynamic_dispatch = getattr(simd_config, "has_dynamic_dispatch", None)
+    if simd_config is not None and (has_dynamic_dispatch is None or has_dynamic_dispatch()):
+        return simd_config.get_level_name()
+    # Older wheels ship one SWIG module per instruction set and import the best one
+    return faiss.Index.__module__.rsplit(".", 1)[-1]
+
+
+# Log the SIMD level FAISS is using (diagnostics only, never fatal)
+try:
+    logger.info(f"FAISS SIMD level in use: {faiss_simd_level()}")
+    logger.info(f"CPU instruction sets: {', '.join(sorted(faiss.supported_instruction_sets()))}")
+except Exception as e:
+    logger.warning(f"Could not determine FAISS SIMD level: {e}")
+
 # Load FAISS index and metadata
 try:
     logger.info(f"Loading FAISS index from {FAISS_INDEX_PATH}")
-    index = faiss.read_index(FAISS_INDEX_PATH)
+    index = faiss.read_index(FAISS_INDEX_PATH, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
     
     logger.info(f"Loading metadata from {METADATA_PATH}")
-    with open(METADATA_PATH, 'r', encoding='utf-8') as f:
-        metadata = json.load(f)
+    metadata_table = feather.read_table(METADATA_PATH, columns=["text", "snippet", "source", "type", "chunk_id"], memory_map=True)
+    
+    # Columnar metadata, indexed by FAISS vector id. String columns stay in the
+    # memory-mapped Arrow buffers and are only materialized for search hits.
+    texts = metadata_table.column("text")
+    snippets = metadata_table.column("snippet")
+    sources = metadata_table.column("source")
+    chunk_types = metadata_table.column("type")
+    chunk_ids = np.asarray(metadata_table.column("chunk_id").fill_null(0), dtype=np.int32)
+    num_metadata = metadata_table.num_rows
     
-    logger.info(f"Loaded {index.ntotal} vectors and {len(metadata)} metadata entries")
+    logger.info(f"Loaded {index.ntotal} vectors and {num_metadata} metadata entries")
 except Exception as e:
     logger.error(f"Failed to load FAISS index or metadata: {e}")
     raise
 
+# Query embedding cache: question text -> normalized float16 bytes (LRU)
+embedding_cache: "OrderedDict[str, bytes]" = OrderedDict()
+
+# Semantic answer cache: recent query embeddings -> generated responses
+answer_cache_index = faiss.IndexIDMap(faiss.IndexFlatIP(index.d))
+answer_cache_entries: "OrderedDict[int, dict]" = OrderedDict()
+answer_cache_ids = count()
+
 # Pydantic models
 class QueryRequest(BaseModel):
     question: str
@@ -75,63 +120,101 @@ app.add_middleware(
 )
 
 
-def get_embedding(text: str) -> np.ndarray:
-    """Get embedding from Gemini API"""
+async def get_embedding(text: str) -> np.ndarray:
+    """Get embedding from Gemini API (repeated questions are served from cache)"""
     try:
-        logger.info(f"Getting embedding for text (length: {len(text)})")
-        
-        # ✅ Updated for google-genai package
-        result = client.models.embed_content(
-            model="text-embedding-004",
-            contents=text
-        )
+        cached = embedding_cache.get(text)
+        if cached is not None:
+            embedding_cache.move_to_end(text)
+        else:
+            logger.info(f"Getting embedding for text (length: {len(text)})")
+            
+            # ✅ Updated for google-genai package
+            result = await client.aio.models.embed_content(
+                model="text-embedding-004",
+                contents=text
+            )
+            
+            embedding = np.array(result.embeddings[0].values, dtype=np.float32).reshape(1, -1)
+            # Normalize for cosine similarity (in place)
+            faiss.normalize_L2(embedding)
+            # FP16 halves the cache footprint; top-K ranking is unchanged
+            cached = embedding[0].astype(np.float16).tobytes()
+            
+            embedding_cache[text] = cached
+            if len(embedding_cache) > EMBEDDING_CACHE_SIZE:
+                embedding_cache.popitem(last=False)
         
-        embedding = np.array(result.embeddings[0].values, dtype=np.float32)
-        # Normalize for cosine similarity
-        normalized = embedding / np.linalg.norm(embedding)
-        return normalized
+        return np.frombuffer(cached, dtype=np.float16).astype(np.float32)
     except Exception as e:
         logger.error(f"Error getting embedding: {e}")
         raise HTTPException(status_code=500, detail=f"Embedding error: {str(e)}")
 
 
-def search_similar(query_embedding: np.ndarray, top_k: int = TOP_K_RESULTS) -> List[dict]:
+async def search_similar(query_embedding: np.ndarray, top_k: int = TOP_K_RESULTS) -> List[dict]:
     """Search FAISS index for similar vectors"""
     try:
         logger.info(f"Searching FAISS index for top {top_k} results")
         
         # Search FAISS index
         query_vector = query_embedding.reshape(1, -1).astype('float32')
-        distances, indices = index.search(query_vector, top_k * 2)
+        # Run the CPU-bound search off the event loop
+        distances, indices = await asyncio.to_thread(index.search, query_vector, top_k)
         
-        # Filter by threshold and gather results
+        # Filter by threshold and gather results (FAISS returns them best-first)
         results = []
-        for i, (dist, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < 0 or idx >= len(metadata):
+        for dist, idx in zip(distances[0], indices[0]):
+            if idx < 0 or idx >= num_metadata:
                 continue
                 
             similarity = float(dist)
             
             if similarity >= SIMILARITY_THRESHOLD:
-                meta = metadata[idx]
                 results.append({
-                    "content": meta["text"],
-                    "source": meta["source"],
-                    "type": meta["type"],
+                    "content": texts[idx].as_py(),
+                    "snippet": snippets[idx].as_py(),
+                    "source": sources[idx].as_py(),
+                    "type": chunk_types[idx].as_py(),
                     "similarity": similarity,
-                    "chunk_id": meta.get("chunk_id", 0)
+                    "chunk_id": int(chunk_ids[idx])
                 })
         
-        results.sort(key=lambda x: x["similarity"], reverse=True)
         logger.info(f"Found {len(results)} results above threshold {SIMILARITY_THRESHOLD}")
         
-        return results[:top_k]
+        return results
     except Exception as e:
         logger.error(f"Error searching FAISS: {e}")
         raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
 
 
-def generate_answer(question: str, context_chunks: List[dict]) -> dict:
+def get_cached_answer(query_embedding: np.ndarray) -> Optional[dict]:
+    """Return a cached response for a near-duplicate question, if any"""
+    if answer_cache_index.ntotal == 0:
+        return None
+    
+    distances, ids = answer_cache_index.search(query_embedding.reshape(1, -1), 1)
+    cache_id = int(ids[0][0])
+    if cache_id < 0 or distances[0][0] < ANSWER_CACHE_THRESHOLD:
+        return None
+    
+    answer_cache_entries.move_to_end(cache_id)
+    entry = answer_cache_entries[cache_id]
+    logger.info(f"Answer cache hit (similarity {distances[0][0]:.3f}) for: '{entry['question'][:50]}...'")
+    return entry["response"]
+
+
+def cache_answer(query_embedding: np.ndarray, question: str, response: dict):
+    """Store a response in the semantic answer cache, evicting the least recently used"""
+    cache_id = next(answer_cache_ids)
+    answer_cache_index.add_with_ids(query_embedding.reshape(1, -1), np.array([cache_id], dtype=np.int64))
+    answer_cache_entries[cache_id] = {"question": question, "response": response}
+    
+    if len(answer_cache_entries) > ANSWER_CACHE_SIZE:
+        evicted_id, _ = answer_cache_entries.popitem(last=False)
+        answer_cache_index.remove_ids(np.array([evicted_id], dtype=np.int64))
+
+
+async def generate_answer(question: str, context_chunks: List[dict]) -> dict:
     """Generate answer using Gemini with retrieved context"""
     try:
         logger.info(f"Generating answer for question: '{question[:50]}...'")
@@ -142,25 +225,23 @@ def generate_answer(question: str, context_chunks: List[dict]) -> dict:
                 "links": []
             }
         
-        # Build context from top chunks
-        context_parts = []
-        sources_used = {}
+        # Build prompt and links in one pass; the prompt is joined only once
+        prompt_parts = [
+            "You are a helpful teaching assistant. Answer the student's question "
+            "using ONLY the provided context below.\n\nContext:\n"
+        ]
+        links = []
         
         for i, chunk in enumerate(context_chunks):
-            source_url = chunk["source"]
-            context_parts.append(f"[Source {i+1}]:\n{chunk['content']}\n")
-            sources_used[i+1] = {
-                "url": source_url,
-                "snippet": chunk["content"][:150]
-            }
-        
-        context = "\n".join(context_parts)
+            if i:
+                prompt_parts.append("\n")
+            prompt_parts.append(f"[Source {i+1}]:\n{chunk['content']}\n")
+            links.append({
+                "url": chunk["source"],
+                "text": chunk["snippet"]
+            })
         
-        # Create prompt
-        prompt = f"""You are a helpful teaching assistant. Answer the student's question using ONLY the provided context below.
-
-Context:
-{context}
+        prompt_parts.append(f"""
 
 Question: {question}
 
@@ -170,11 +251,12 @@ Instructions:
 3. Reference specific sources when making claims (e.g., "According to Source 1...")
 4. Be concise but thorough
 
-Answer:"""
+Answer:""")
+        prompt = "".join(prompt_parts)
 
         # ✅ Updated for google-genai package
         logger.info("Calling Gemini API for answer generation")
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model="gemini-2.0-flash-exp",
             contents=prompt
         )
@@ -182,14 +264,6 @@ Answer:"""
         answer_text = response.text
         logger.info(f"Generated answer (length: {len(answer_text)})")
         
-        # Extract links from sources used
-        links = []
-        for source_num, source_info in sources_used.items():
-            links.append({
-                "url": source_info["url"],
-                "text": source_info["snippet"]
-            })
-        
         return {
             "answer": answer_text,
             "links": links
@@ -207,13 +281,19 @@ async def query_knowledge_base(request: QueryRequest):
         logger.info(f"Received query: '{request.question[:50]}...'")
         
         # Get query embedding
-        query_embedding = get_embedding(request.question)
+        query_embedding = await get_embedding(request.question)
+        
+        # Reuse the answer to a semantically equivalent question
+        cached = get_cached_answer(query_embedding)
+        if cached is not None:
+            return cached
         
         # Search for similar content
-        similar_chunks = search_similar(query_embedding)
+        similar_chunks = await search_similar(query_embedding)
         
         # Generate answer
-        result = generate_answer(request.question, similar_chunks)
+        result = await generate_answer(request.question, similar_chunks)
+        cache_answer(query_embedding, request.question, result)
         
         logger.info("Query processed successfully")
         return result
@@ -232,7 +312,7 @@ async def health_check():
         return {
             "status": "healthy",
             "faiss_vectors": index.ntotal,
-            "metadata_entries": len(metadata),
+            "metadata_entries": num_metadata,
             "gemini_api_configured": bool(GEMINI_API_KEY)
         }
     except Exception as e:
@@ -1,81 +1,161 @@
 import os
 import faiss
-import json
+import orjson
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import sqlite3
 import numpy as np
-from typing import List, Dict
-from bs4 import BeautifulSoup
+import pyarrow as pa
+import pyarrow.feather as feather
+from typing import List, Dict, Tuple
+from selectolax.lexbor import LexborHTMLParser
 import markdown as md
 from dotenv import load_dotenv
-import google as genai
-import time
+from google import genai
+from google.genai import types, errors
 
 load_dotenv()
 
 # CONFIGURATION
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
+client = genai.Client(api_key=GEMINI_API_KEY)
 
 # Embedding & FAISS parameters
+EMBED_MODEL = "text-embedding-004"
 EMBED_DIM = 768  # Gemini embedding dimension
-BATCH_SIZE = 100  # Gemini has higher rate limits
+EMBED_CACHE_PATH = "model/embed_cache.sqlite"
+BATCH_SIZE = 100  # texts per embed_content request (Gemini batch limit)
 CHUNK_SIZE = 2000  # words per chunk (Gemini handles longer context well)
 CHUNK_OVERLAP = 200
+SNIPPET_CHARS = 150  # source preview returned with answers
+EMBED_CONCURRENCY = 20  # max in-flight embedding requests
+HNSW_M = 32  # graph neighbours per node
+HNSW_EF_CONSTRUCTION = 200
 
-# Initialize FAISS
-index = faiss.IndexFlatIP(EMBED_DIM)
+# Lookup table of characters str.split() treats as whitespace (none above
+# U+3000); the extra trailing False covers every higher code point
+_IS_WHITESPACE = np.array([chr(c).isspace() for c in range(0x3001)] + [False])
+
+# Initialize FAISS (HNSW graph over 8-bit scalar-quantized vectors,
+# inner product on normalized vectors = cosine)
+index = faiss.IndexHNSWSQ(EMBED_DIM, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
 metadata: List[Dict] = []
 
 
+def word_spans(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and end character offsets of each whitespace-separated word"""
+    # One UTF-32 code unit per character, so array positions are str offsets
+    codes = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+    is_word = ~_IS_WHITESPACE[np.minimum(codes, len(_IS_WHITESPACE) - 1)]
+    edges = np.diff(is_word.astype(np.int8), prepend=0, append=0)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
 def chunk_by_words(text: str, max_words: int, overlap: int) -> List[str]:
     """Split text into chunks by word count with overlap"""
-    words = text.split()
-    chunks = []
-    start = 0
-    while start < len(words):
-        end = min(start + max_words, len(words))
-        chunk = " ".join(words[start:end])
-        chunks.append(chunk)
-        start += max_words - overlap
-    return chunks
-
-
-def embed_text(text: str) -> list:
-    """Get normalized embedding from Gemini API"""
-    result = genai.embed_content(
-        model="models/text-embedding-004",
-        content=text,
-        task_type="retrieval_document"
+    # Most documents fit in one chunk; a bounded split detects that without
+    # building the full word list or offset arrays
+    step = max_words - overlap
+    if 0 < step and len(text.split(maxsplit=step)) <= step:
+        stripped = text.strip()
+        return [stripped] if stripped else []
+    
+    # Window boundaries are computed on the offset arrays; chunks are sliced
+    # straight out of the original text
+    starts, ends = word_spans(text)
+    first = np.arange(0, len(starts), step)
+    last = np.minimum(first + max_words, len(starts)) - 1
+    return [text[a:b] for a, b in zip(starts[first].tolist(), ends[last].tolist())]
+
+
+async def embed_texts(texts: List[str]) -> List[list]:
+    """Get raw embeddings for a batch of texts in one Gemini API call"""
+    result = await client.aio.models.embed_content(
+        model=EMBED_MODEL,
+        contents=texts,
+        config=types.EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT")
     )
-    embedding = np.array(result['embedding'], dtype=np.float32)
-    normalized_embedding = embedding / np.linalg.norm(embedding)
-    return normalized_embedding.tolist()
+    return [item.values for item in result.embeddings]
+
+
+def is_invalid_input(e: Exception) -> bool:
+    """True for errors caused by the request's inputs (e.g. a text over the token limit)"""
+    return isinstance(e, errors.ClientError) and (e.code == 400 or e.status == "INVALID_ARGUMENT")
 
 
-def safe_embed(text: str, retry_count: int = 0) -> list:
-    """Embed text with error handling for rate limits"""
+async def safe_embed(texts: List[str], semaphore: asyncio.Semaphore, retry_count: int = 0) -> List[list]:
+    """Embed a batch of texts with error handling for rate limits and bad inputs"""
     try:
-        return embed_text(text)
+        async with semaphore:
+            return await embed_texts(texts)
     except Exception as e:
-        if "quota" in str(e).lower() or "rate" in str(e).lower():
+        if isinstance(e, errors.ClientError) and e.code == 429:
             if retry_count < 3:
                 wait_time = 10 * (retry_count + 1)
                 print(f"Rate limit hit, waiting {wait_time}s...")
-                time.sleep(wait_time)
-                return safe_embed(text, retry_count + 1)
-        elif len(text) > 10000:  # If text too long, split it
+                await asyncio.sleep(wait_time)
+                return await safe_embed(texts, semaphore, retry_count + 1)
+        elif is_invalid_input(e) and any(len(t) > 10000 for t in texts):
+            # Only over-long texts can be recovered, so split the batch down to
+            # them; any other rejected input still fails the batch below
+            if len(texts) > 1:
+                mid = len(texts) // 2
+                left, right = await asyncio.gather(
+                    safe_embed(texts[:mid], semaphore),
+                    safe_embed(texts[mid:], semaphore)
+                )
+                return left + right
+            # Embed the over-long text in halves and average them
+            text = texts[0]
             mid = len(text) // 2
-            left = safe_embed(text[:mid])
-            right = safe_embed(text[mid:])
-            return ((np.array(left) + np.array(right)) / 2).tolist()
+            left, right = await safe_embed([text[:mid], text[mid:]], semaphore)
+            return [((np.array(left) + np.array(right)) / 2).tolist()]
         raise
 
 
+def open_embed_cache(path: str = EMBED_CACHE_PATH) -> sqlite3.Connection:
+    """Open (or create) the on-disk embedding cache"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS embeddings "
+        "(hash TEXT PRIMARY KEY, model TEXT, vec BLOB)"
+    )
+    return conn
+
+
+def cache_key(text: str) -> str:
+    """Cache key for a text; includes the model so switching models re-embeds"""
+    return hashlib.sha256(f"{EMBED_MODEL}\n{text}".encode("utf-8")).hexdigest()
+
+
 def load_markdown(path: str) -> str:
     """Load and convert markdown to plain text"""
     with open(path, encoding="utf-8") as f:
         raw = f.read()
     html = md.markdown(raw)
-    return BeautifulSoup(html, "html.parser").get_text("\n")
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(["script", "style"])
+    return tree.text(separator="\n")
+
+
+def _process_markdown_file(full_path: str) -> Tuple[List[str], List[Dict], int, int]:
+    """Load and chunk one markdown file (runs in a worker process)"""
+    fname = os.path.basename(full_path)
+    text = load_markdown(full_path)
+    chunks = chunk_by_words(text, max_words=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
+    
+    metas = []
+    for idx in range(len(chunks)):
+        metas.append({
+            "source": f"Course: {fname.replace('.md', '')}",
+            "type": "course_content",
+            "chunk_id": idx,
+            "total_chunks": len(chunks)
+        })
+    return chunks, metas, len(text), len(text.split())
 
 
 def ingest_markdown_files():
@@ -89,24 +169,15 @@ def ingest_markdown_files():
     
     print(f"\n=== Processing Markdown Files ===")
     files = [f for f in os.listdir(markdown_dir) if f.endswith(".md")]
+    paths = [os.path.join(markdown_dir, fname) for fname in files]
     
-    for fname in files:
-        full_path = os.path.join(markdown_dir, fname)
-        text = load_markdown(full_path)
-        word_count = len(text.split())
-        print(f"Loaded {fname}: {len(text)} chars, {word_count} words")
-        
-        chunks = chunk_by_words(text, max_words=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
-        
-        for idx, chunk in enumerate(chunks):
-            meta = {
-                "source": f"Course: {fname.replace('.md', '')}",
-                "type": "course_content",
-                "chunk_id": idx,
-                "total_chunks": len(chunks)
-            }
-            batch_texts.append(chunk)
-            batch_meta.append(meta)
+    # Parsing and chunking is CPU-bound, so fan it out across cores
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(_process_markdown_file, paths)
+        for fname, (chunks, metas, char_count, word_count) in zip(files, results):
+            print(f"Loaded {fname}: {char_count} chars, {word_count} words")
+            batch_texts.extend(chunks)
+            batch_meta.extend(metas)
     
     print(f"Created {len(batch_texts)} chunks from {len(files)} markdown files")
     return batch_texts, batch_meta
@@ -122,8 +193,8 @@ def ingest_discourse_json():
         return batch_texts, batch_meta
     
     print(f"\n=== Processing Discourse Posts ===")
-    with open(discourse_file, 'r', encoding='utf-8') as f:
-        posts = json.load(f)
+    with open(discourse_file, 'rb') as f:
+        posts = orjson.loads(f.read())
     
     # Group posts by topic_id
     topics = {}
@@ -168,23 +239,60 @@ def ingest_discourse_json():
     return batch_texts, batch_meta
 
 
-def index_batch(texts: List[str], metas: List[Dict]):
-    """Embed texts and add to FAISS index"""
-    print(f"\nEmbedding batch of {len(texts)} chunks...")
+async def index_batch(texts: List[str], metas: List[Dict]):
+    """Embed texts (cached or in concurrent batched requests) and add to FAISS index"""
+    conn = open_embed_cache()
+    keys = [cache_key(t) for t in texts]
     embs = []
-    for i, text in enumerate(texts):
-        if i % 10 == 0:
-            print(f"  Embedding {i+1}/{len(texts)}...")
-        emb = safe_embed(text)
-        embs.append(emb)
+    for key in keys:
+        row = conn.execute("SELECT vec FROM embeddings WHERE hash = ?", (key,)).fetchone()
+        embs.append(np.frombuffer(row[0], dtype=np.float32) if row else None)
+    
+    missing = [i for i, emb in enumerate(embs) if emb is None]
+    print(f"\n{len(texts) - len(missing)} chunks cached; embedding {len(missing)} in batches of {BATCH_SIZE}...")
+    # Shared by every embed_content call, including retries and split sub-batches
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    
+    async def embed_and_cache(batch: List[int]):
+        """Embed one batch and write it to the cache as soon as it returns"""
+        batch_embs = await safe_embed([texts[i] for i in batch], semaphore)
+        for i, emb in zip(batch, batch_embs):
+            embs[i] = np.asarray(emb, dtype=np.float32)
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (hash, model, vec) VALUES (?, ?, ?)",
+            [(keys[i], EMBED_MODEL, embs[i].tobytes()) for i in batch]
+        )
+        conn.commit()
     
-    arr = np.array(embs, dtype=np.float32)
+    # Let every batch finish so one failure doesn't discard embeddings already paid for
+    batches = [missing[i:i+BATCH_SIZE] for i in range(0, len(missing), BATCH_SIZE)]
+    results = await asyncio.gather(*[embed_and_cache(b) for b in batches], return_exceptions=True)
+    conn.close()
+    failures = [r for r in results if isinstance(r, BaseException)]
+    if failures:
+        print(f"❌ {len(failures)} of {len(batches)} batches failed; the rest are cached for the next run")
+        raise failures[0]
+    
+    arr = np.ascontiguousarray(np.stack(embs), dtype=np.float32)
+    # Normalize the whole batch in place for cosine similarity
+    faiss.normalize_L2(arr)
+    if not index.is_trained:
+        # Learn the per-dimension ranges for 8-bit quantization
+        index.train(arr)
     index.add(arr)
-    metadata.extend([{"text": t, **m} for t, m in zip(texts, metas)])
+    metadata.extend([{"text": t, "snippet": t[:SNIPPET_CHARS], **m} for t, m in zip(texts, metas)])
     print(f"✓ Indexed {len(texts)} chunks; total index size: {index.ntotal}")
 
 
-def main():
+def metadata_table(metadata: List[Dict]) -> pa.Table:
+    """Columnar table of chunk metadata with one column per key seen in any entry"""
+    # pa.Table.from_pylist would take the schema from the first entry only and
+    # drop discourse-only keys (topic_id, topic_title); missing values are null
+    columns = dict.fromkeys(key for meta in metadata for key in meta)
+    return pa.table({col: [meta.get(col) for meta in metadata] for col in columns})
+
+
+async def main():
     """Main ingestion pipeline"""
     print("=" * 60)
     print("VirtualTA Embedding Pipeline (Gemini)")
@@ -214,11 +322,7 @@ def main():
     print(f"Total chunks to embed: {len(all_texts)}")
     print(f"{'=' * 60}\n")
     
-    # Process in batches
-    for i in range(0, len(all_texts), BATCH_SIZE):
-        batch_texts = all_texts[i:i+BATCH_SIZE]
-        batch_meta = all_meta[i:i+BATCH_SIZE]
-        index_batch(batch_texts, batch_meta)
+    await index_batch(all_texts, all_meta)
     
     # Save outputs
     os.makedirs("model/", exist_ok=True)
@@ -228,17 +332,17 @@ def main():
     faiss.write_index(index, "model/virtual-ta.faiss")
     print("✓ Saved FAISS index: model/virtual-ta.faiss")
     
-    with open("model/metadata.json", "w", encoding="utf-8") as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
-    print("✓ Saved metadata: model/metadata.json")
+    # Uncompressed Arrow IPC so app.py can memory-map it
+    feather.write_feather(metadata_table(metadata), "model/metadata.arrow", compression="uncompressed")
+    print("✓ Saved metadata: model/metadata.arrow")
     
     print(f"{'=' * 60}")
     print("✓ Ingestion Complete!")
     print(f"  Total indexed chunks: {index.ntotal}")
     print(f"  Index dimension: {EMBED_DIM}")
-    print(f"  Model: Gemini text-embedding-004")
+    print(f"  Model: Gemini {EMBED_MODEL}")
     print(f"{'=' * 60}\n")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
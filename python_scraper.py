@@ -2,7 +2,7 @@ import os
 import json
 from datetime import datetime
 from playwright.sync_api import sync_playwright, TimeoutError
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 
 # === CONFIG ===
 BASE_URL = "https://discourse.onlinedegree.iitm.ac.in"
@@ -18,6 +18,11 @@ def parse_date(date_str):
     except ValueError:
         return datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%SZ")
 
+def html_to_text(html):
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(["script", "style"])
+    return tree.text()
+
 def login_and_save_auth(playwright):
     print("🔐 No auth found. Launching browser for manual login...")
     browser = playwright.chromium.launch(headless=False)
@@ -105,7 +110,7 @@ def scrape_posts(playwright):
                     "is_accepted_answer": post["id"] == accepted_answer_id,
                     "mentioned_users": [u["username"] for u in post.get("mentioned_users", [])],
                     "url": f"{BASE_URL}/t/{topic['slug']}/{topic['id']}/{post['post_number']}",
-                    "content": BeautifulSoup(post["cooked"], "html.parser").get_text()
+                    "content": html_to_text(post["cooked"])
                 })
 
     with open("discourse_posts.json", "w") as f:
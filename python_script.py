@@ -1,9 +1,10 @@
 import os
-import json
+import orjson
+import asyncio
 from datetime import datetime
 from playwright.sync_api import sync_playwright, TimeoutError
-from bs4 import BeautifulSoup
-import requests
+from selectolax.lexbor import LexborHTMLParser
+import httpx
 
 
 # === CONFIG ===
@@ -14,6 +15,8 @@ AUTH_STATE_FILE = "auth.json"
 COOKIES_FILE = "cookies.json"
 DATE_FROM = datetime(2025, 1, 1)
 DATE_TO = datetime(2025, 4, 14)
+TOPIC_FETCH_CONCURRENCY = 16
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
 
 
 def parse_date(date_str):
@@ -23,6 +26,13 @@ def parse_date(date_str):
         return datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%SZ")
 
 
+def html_to_text(html):
+    """Extract plain text from post HTML (script/style contents dropped)"""
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(["script", "style"])
+    return tree.text()
+
+
 def login_and_save_auth(playwright):
     """Manual login via Playwright and save cookies"""
     print("🔐 No auth found. Launching browser for manual login...")
@@ -38,8 +48,8 @@ def login_and_save_auth(playwright):
     
     # Extract and save cookies separately
     cookies = context.cookies()
-    with open(COOKIES_FILE, 'w') as f:
-        json.dump(cookies, f, indent=2)
+    with open(COOKIES_FILE, 'wb') as f:
+        f.write(orjson.dumps(cookies, option=orjson.OPT_INDENT_2))
     
     print("✅ Login state and cookies saved.")
     browser.close()
@@ -48,27 +58,27 @@ def login_and_save_auth(playwright):
 def extract_cookies_from_storage_state():
     """Extract cookies from Playwright storage_state file"""
     if os.path.exists(AUTH_STATE_FILE):
-        with open(AUTH_STATE_FILE, 'r') as f:
-            storage_state = json.load(f)
+        with open(AUTH_STATE_FILE, 'rb') as f:
+            storage_state = orjson.loads(f.read())
         cookies = storage_state.get('cookies', [])
         
-        with open(COOKIES_FILE, 'w') as f:
-            json.dump(cookies, f, indent=2)
+        with open(COOKIES_FILE, 'wb') as f:
+            f.write(orjson.dumps(cookies, option=orjson.OPT_INDENT_2))
         
         print(f"✅ Extracted {len(cookies)} cookies from storage state")
         return cookies
     return []
 
 
-def load_cookies_for_requests():
-    """Load cookies from file and convert to requests format"""
+def load_cookies_for_httpx():
+    """Load cookies from file and convert to a name -> value dict for httpx"""
     if not os.path.exists(COOKIES_FILE):
         return {}
     
-    with open(COOKIES_FILE, 'r') as f:
-        playwright_cookies = json.load(f)
+    with open(COOKIES_FILE, 'rb') as f:
+        playwright_cookies = orjson.loads(f.read())
     
-    # Convert Playwright cookie format to requests format
+    # Convert Playwright cookie format to a plain cookie dict
     cookies_dict = {}
     for cookie in playwright_cookies:
         # Filter cookies for the target domain
@@ -78,46 +88,41 @@ def load_cookies_for_requests():
     return cookies_dict
 
 
-def is_authenticated_with_cookies(session):
+def is_authenticated_with_cookies(client):
     """Check if cookies are valid by making a test request"""
     try:
-        response = session.get(CATEGORY_JSON_URL, timeout=10)
+        response = client.get(CATEGORY_JSON_URL, timeout=10)
         if response.status_code == 200:
-            response.json()  # Validate JSON response
+            orjson.loads(response.content)  # Validate JSON response
             return True
-    except (requests.RequestException, json.JSONDecodeError):
+    except (httpx.HTTPError, orjson.JSONDecodeError):
         return False
     return False
 
 
-def scrape_posts_with_requests():
-    """Scrape posts using requests library with cookies"""
-    print("🔍 Starting scrape using saved cookies...")
-    
-    # Create requests session
-    session = requests.Session()
-    
-    # Load cookies
-    cookies = load_cookies_for_requests()
-    if not cookies:
-        print("❌ No cookies found. Please authenticate first.")
-        return
-    
-    # Set cookies and headers
-    session.cookies.update(cookies)
-    session.headers.update({
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-        'Accept': 'application/json',
-        'Accept-Language': 'en-US,en;q=0.9'
-    })
-    
-    # Check authentication
-    if not is_authenticated_with_cookies(session):
-        print("⚠️ Cookies invalid or expired. Please re-authenticate.")
-        return
-    
-    print("✅ Authenticated successfully with cookies")
+async def fetch_topics(topics, cookies, headers):
+    """Fetch topic JSON for all topics concurrently (None for failed fetches)"""
+    semaphore = asyncio.Semaphore(TOPIC_FETCH_CONCURRENCY)
     
+    async with httpx.AsyncClient(cookies=cookies, headers=headers, http2=True,
+                                 limits=HTTP_LIMITS, timeout=15,
+                                 follow_redirects=True) as client:
+        async def fetch_topic(topic):
+            topic_url = f"{BASE_URL}/t/{topic['slug']}/{topic['id']}.json"
+            async with semaphore:
+                try:
+                    response = await client.get(topic_url)
+                    response.raise_for_status()
+                    return orjson.loads(response.content)
+                except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+                    print(f"⚠️ Error fetching topic {topic['id']}: {e}")
+                    return None
+        
+        return await asyncio.gather(*[fetch_topic(t) for t in topics])
+
+
+def fetch_topic_list(client):
+    """Fetch all topics in the category, following pagination"""
     all_topics = []
     page_num = 0
     
@@ -126,10 +131,10 @@ def scrape_posts_with_requests():
         print(f"📦 Fetching page {page_num}...")
         
         try:
-            response = session.get(paginated_url, timeout=15)
+            response = client.get(paginated_url)
             response.raise_for_status()
-            data = response.json()
-        except requests.RequestException as e:
+            data = orjson.loads(response.content)
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
             print(f"❌ Error fetching page {page_num}: {e}")
             break
         
@@ -140,55 +145,83 @@ def scrape_posts_with_requests():
         all_topics.extend(topics)
         page_num += 1
     
+    return all_topics
+
+
+def scrape_posts_with_httpx():
+    """Scrape posts over pooled HTTP/2 httpx clients with cookies"""
+    print("🔍 Starting scrape using saved cookies...")
+    
+    # Load cookies
+    cookies = load_cookies_for_httpx()
+    if not cookies:
+        print("❌ No cookies found. Please authenticate first.")
+        return
+    
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        'Accept': 'application/json',
+        'Accept-Language': 'en-US,en;q=0.9'
+    }
+    
+    with httpx.Client(cookies=cookies, headers=headers, http2=True,
+                      limits=HTTP_LIMITS, timeout=15,
+                      follow_redirects=True) as client:
+        # Check authentication
+        if not is_authenticated_with_cookies(client):
+            print("⚠️ Cookies invalid or expired. Please re-authenticate.")
+            return
+        
+        print("✅ Authenticated successfully with cookies")
+        all_topics = fetch_topic_list(client)
+    
     print(f"📄 Found {len(all_topics)} total topics across all pages")
     
+    topics_in_range = [
+        topic for topic in all_topics
+        if DATE_FROM <= parse_date(topic["created_at"]) <= DATE_TO
+    ]
+    print(f"🧵 Fetching {len(topics_in_range)} topics in range ({TOPIC_FETCH_CONCURRENCY} at a time)...")
+    topic_results = asyncio.run(fetch_topics(topics_in_range, cookies, headers))
+    
     filtered_posts = []
-    for topic in all_topics:
-        created_at = parse_date(topic["created_at"])
-        if DATE_FROM <= created_at <= DATE_TO:
-            topic_url = f"{BASE_URL}/t/{topic['slug']}/{topic['id']}.json"
-            
-            try:
-                response = session.get(topic_url, timeout=15)
-                response.raise_for_status()
-                topic_data = response.json()
-            except requests.RequestException as e:
-                print(f"⚠️ Error fetching topic {topic['id']}: {e}")
-                continue
-            
-            posts = topic_data.get("post_stream", {}).get("posts", [])
-            accepted_answer_id = topic_data.get("accepted_answer", topic_data.get("accepted_answer_post_id"))
-            
-            # Build reply count map
-            reply_counter = {}
-            for post in posts:
-                reply_to = post.get("reply_to_post_number")
-                if reply_to is not None:
-                    reply_counter[reply_to] = reply_counter.get(reply_to, 0) + 1
-            
-            for post in posts:
-                filtered_posts.append({
-                    "topic_id": topic["id"],
-                    "topic_title": topic.get("title"),
-                    "category_id": topic.get("category_id"),
-                    "tags": topic.get("tags", []),
-                    "post_id": post["id"],
-                    "post_number": post["post_number"],
-                    "author": post["username"],
-                    "created_at": post["created_at"],
-                    "updated_at": post.get("updated_at"),
-                    "reply_to_post_number": post.get("reply_to_post_number"),
-                    "is_reply": post.get("reply_to_post_number") is not None,
-                    "reply_count": reply_counter.get(post["post_number"], 0),
-                    "like_count": post.get("like_count", 0),
-                    "is_accepted_answer": post["id"] == accepted_answer_id,
-                    "mentioned_users": [u["username"] for u in post.get("mentioned_users", [])],
-                    "url": f"{BASE_URL}/t/{topic['slug']}/{topic['id']}/{post['post_number']}",
-                    "content": BeautifulSoup(post["cooked"], "html.parser").get_text()
-                })
-    
-    with open("discourse_posts.json", "w") as f:
-        json.dump(filtered_posts, f, indent=2)
+    for topic, topic_data in zip(topics_in_range, topic_results):
+        if topic_data is None:
+            continue
+        
+        posts = topic_data.get("post_stream", {}).get("posts", [])
+        accepted_answer_id = topic_data.get("accepted_answer", topic_data.get("accepted_answer_post_id"))
+        
+        # Build reply count map
+        reply_counter = {}
+        for post in posts:
+            reply_to = post.get("reply_to_post_number")
+            if reply_to is not None:
+                reply_counter[reply_to] = reply_counter.get(reply_to, 0) + 1
+        
+        for post in posts:
+            filtered_posts.append({
+                "topic_id": topic["id"],
+                "topic_title": topic.get("title"),
+                "category_id": topic.get("category_id"),
+                "tags": topic.get("tags", []),
+                "post_id": post["id"],
+                "post_number": post["post_number"],
+                "author": post["username"],
+                "created_at": post["created_at"],
+                "updated_at": post.get("updated_at"),
+                "reply_to_post_number": post.get("reply_to_post_number"),
+                "is_reply": post.get("reply_to_post_number") is not None,
+                "reply_count": reply_counter.get(post["post_number"], 0),
+                "like_count": post.get("like_count", 0),
+                "is_accepted_answer": post["id"] == accepted_answer_id,
+                "mentioned_users": [u["username"] for u in post.get("mentioned_users", [])],
+                "url": f"{BASE_URL}/t/{topic['slug']}/{topic['id']}/{post['post_number']}",
+                "content": html_to_text(post["cooked"])
+            })
+    
+    with open("discourse_posts.json", "wb") as f:
+        f.write(orjson.dumps(filtered_posts, option=orjson.OPT_INDENT_2))
     
     print(f"✅ Scraped {len(filtered_posts)} posts between {DATE_FROM.date()} and {DATE_TO.date()}")
 
@@ -206,22 +239,23 @@ def main():
                 login_and_save_auth(p)
     
     # Verify cookies are still valid
-    session = requests.Session()
-    cookies = load_cookies_for_requests()
-    session.cookies.update(cookies)
-    session.headers.update({
+    cookies = load_cookies_for_httpx()
+    headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-    })
+    }
+    with httpx.Client(cookies=cookies, headers=headers, http2=True,
+                      follow_redirects=True) as client:
+        authenticated = is_authenticated_with_cookies(client)
     
-    if not is_authenticated_with_cookies(session):
+    if not authenticated:
         print("⚠️ Cookies invalid or expired. Re-authenticating...")
         with sync_playwright() as p:
             login_and_save_auth(p)
     else:
         print("✅ Using existing cookies")
     
-    # Scrape using requests
-    scrape_posts_with_requests()
+    # Scrape using httpx
+    scrape_posts_with_httpx()
 
 
 if __name__ == "__main__":